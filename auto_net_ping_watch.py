@@ -17,18 +17,24 @@ Wykrywa:
 
 import os
 import time
+import asyncio
+import atexit
+import threading
 import subprocess
 import logging
+import re
+import shutil
 import smtplib
 import ssl
+import socket
+import struct
 from email.message import EmailMessage
-from datetime import datetime
 
-PUBLIC_HOSTS = [
+PUBLIC_HOSTS = tuple(
     h.strip()
     for h in os.getenv("ANPW_PUBLIC", "1.1.1.1,8.8.8.8,9.9.9.9").split(",")
     if h.strip()
-]
+)
 
 WAN_HOST = os.getenv("ANPW_WAN_HOST", "").strip() or None
 
@@ -36,8 +42,14 @@ INTERVAL_SEC = int(os.getenv("ANPW_INTERVAL", "5"))
 FAIL_THRESHOLD = int(os.getenv("ANPW_FAIL_THRESHOLD", "3"))
 OK_THRESHOLD = int(os.getenv("ANPW_OK_THRESHOLD", "2"))
 PING_TIMEOUT_S = int(os.getenv("ANPW_PING_TIMEOUT", "1"))
+PING_COUNT = int(os.getenv("ANPW_PING_COUNT", "1"))
 NOTIFY_ON_START = os.getenv("ANPW_NOTIFY_ON_START", "1") == "1"
 ROUTER_REDISCOVER_EVERY = int(os.getenv("ANPW_ROUTER_REDISCOVER_EVERY", "300"))
+# <=0 traktowane jak 1 (pełny zestaw pingów w każdym cyklu)
+OUTAGE_FULL_PROBE_EVERY = max(1, int(os.getenv("ANPW_OUTAGE_FULL_PROBE_EVERY", "6")))
+DNS_TTL_SEC = int(os.getenv("ANPW_DNS_TTL", "900"))
+# po błędzie DNS kolejna próba dopiero po tylu sekundach, nie w każdym cyklu
+DNS_RETRY_SEC = int(os.getenv("ANPW_DNS_RETRY", "60"))
 
 SMTP_HOST = os.getenv("ANPW_SMTP_HOST", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("ANPW_SMTP_PORT", "587"))
@@ -46,12 +58,27 @@ SMTP_PASS = os.getenv("ANPW_SMTP_PASS", "")
 MAIL_FROM = os.getenv("ANPW_MAIL_FROM", "Auto Ping Watch <noreply@example.com>")
 MAIL_TO = [x.strip() for x in os.getenv("ANPW_MAIL_TO", "").split(",") if x.strip()]
 
+# Niezmienna część treści maili (router może się zmienić, więc jest osobno).
+_MAIL_FOOTER = (
+    f"Cele publiczne: {', '.join(PUBLIC_HOSTS)}\n"
+    f"Host WAN: {WAN_HOST or 'brak (ANPW_WAN_HOST)'}\n"
+    f"Progi: FAIL>={FAIL_THRESHOLD}, OK>={OK_THRESHOLD}, interwał={INTERVAL_SEC}s\n"
+)
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
 
+TS_FORMAT = "%Y-%m-%d %H:%M:%S %Z"
+
+
+def fmt_ts(ts: float) -> str:
+    """Epoch -> lokalny timestamp 'YYYY-MM-DD HH:MM:SS TZ'."""
+    return time.strftime(TS_FORMAT, time.localtime(ts))
+
+
 def now_local() -> str:
     """Zwraca timestamp lokalny 'YYYY-MM-DD HH:MM:SS TZ'."""
-    return datetime.now().astimezone().strftime("%Y-%m-%d %H:%M:%S %Z")
+    return fmt_ts(time.time())
 
 
 def fmt_dur(sec: float) -> str:
@@ -79,56 +106,403 @@ def run_cmd(args: list[str]) -> tuple[int, str]:
         return 1, f"ERR: {e}"
 
 
-def discover_default_gateway() -> str | None:
+RTF_GATEWAY = 0x2
+
+
+def discover_default_gateway_procfs() -> str | None:
     """
-    Wykryj bramę domyślną IPv4 poprzez `ip route`.
+    Wykryj bramę domyślną IPv4 czytając /proc/net/route (bez forka `ip`).
+
+    Kolumny Destination/Gateway są zapisane jako hex w kolejności bajtów hosta.
     """
-    rc, out = run_cmd(["ip", "-4", "route", "show", "default"])
-    if rc == 0 and out:
-        for line in out.splitlines():
-            parts = line.split()
-            if parts and parts[0] == "default":
-                try:
-                    idx = parts.index("via")
-                    return parts[idx + 1]
-                except (ValueError, IndexError):
-                    continue
-
-    rc, out = run_cmd(["ip", "route"])
-    if rc == 0 and out:
-        for line in out.splitlines():
-            parts = line.split()
-            if parts and parts[0] == "default":
-                try:
-                    idx = parts.index("via")
-                    return parts[idx + 1]
-                except (ValueError, IndexError):
-                    continue
+    try:
+        with open("/proc/net/route") as f:
+            lines = f.read().splitlines()[1:]  # pomiń nagłówek
+    except OSError:
+        return None
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 4:
+            continue
+        try:
+            dest, gw, flags = fields[1], int(fields[2], 16), int(fields[3], 16)
+        except ValueError:
+            continue
+        if dest == "00000000" and flags & RTF_GATEWAY:
+            return socket.inet_ntoa(struct.pack("=L", gw))
+    return None
+
+
+def _extract_gateway(out: str) -> str | None:
+    """Adres `via` z pierwszej trasy `default` w wyjściu `ip -o route`."""
+    for line in out.splitlines():
+        parts = line.split()
+        if parts and parts[0] == "default" and "via" in parts:
+            idx = parts.index("via")
+            if idx + 1 < len(parts):
+                return parts[idx + 1]
     return None
 
 
-def ping_once(host: str, timeout_s: int = 1) -> bool:
+def discover_default_gateway() -> str | None:
+    """
+    Wykryj bramę domyślną IPv4 – najpierw z /proc/net/route,
+    awaryjnie poprzez `ip route`.
+    """
+    gw = discover_default_gateway_procfs()
+    if gw:
+        return gw
+
+    rc, out = run_cmd(["ip", "-4", "-o", "route", "list", "default"])
+    gw = _extract_gateway(out) if rc == 0 else None
+    if gw:
+        return gw
+
+    rc, out = run_cmd(["ip", "-o", "route"])
+    return _extract_gateway(out) if rc == 0 else None
+
+
+# host -> (ipv4 lub None, czas wygaśnięcia wg time.time())
+_resolve_cache: dict[str, tuple[str | None, float]] = {}
+
+
+async def resolve(host: str, ttl: int = DNS_TTL_SEC) -> str | None:
+    """
+    Zamień nazwę hosta na adres IPv4, z cache ważnym `ttl` sekund.
+
+    Zapytanie idzie przez loop.getaddrinfo (pula wątków), więc wolny
+    resolver nie blokuje pętli. Przy błędzie DNS zwraca ostatni znany adres,
+    a None gdy nazwy nigdy nie udało się rozwiązać; w obu przypadkach
+    kolejna próba dopiero po DNS_RETRY_SEC.
+    """
+    now = time.time()
+    cached = _resolve_cache.get(host)
+    if cached and now < cached[1]:
+        return cached[0]
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            host, None, family=socket.AF_INET
+        )
+    except socket.gaierror:
+        ip = cached[0] if cached else None
+        _resolve_cache[host] = (ip, now + DNS_RETRY_SEC)
+        return ip
+    ip = infos[0][4][0]
+    _resolve_cache[host] = (ip, now + ttl)
+    return ip
+
+
+_PING_BIN = shutil.which("ping")
+# file_actions dla posix_spawn: stdout/stderr -> /dev/null. Deskryptor
+# otwierany raz przy imporcie – pingi startują równolegle z wielu wątków.
+_DEVNULL_FD = os.open(os.devnull, os.O_WRONLY)
+_SPAWN_ACTIONS = [
+    (os.POSIX_SPAWN_DUP2, _DEVNULL_FD, 1),
+    (os.POSIX_SPAWN_DUP2, _DEVNULL_FD, 2),
+]
+
+
+def _ping_subprocess(host: str, timeout_s: int) -> bool:
     """
-    Jednorazowy ping ICMP do hosta.
+    Ping przez binarkę `ping` (zwraca True przy kodzie 0).
 
-    Zwraca True jeśli `ping` zwróci kod 0.
+    Uruchamiana bezpośrednio przez os.posix_spawn – bez narzutu
+    subprocess.Popen.
     """
+    if _PING_BIN is None:
+        logging.error("Brak binarki `ping`. Zainstaluj iputils-ping w obrazie.")
+        time.sleep(5)
+        return False
+    if PING_COUNT > 1:
+        return ping_multi(host, PING_COUNT, timeout_s=timeout_s) >= 1
+    argv = ["ping", "-n", "-c", "1", "-W", str(timeout_s), host]
     try:
-        res = subprocess.run(
-            ["ping", "-n", "-c", "1", "-W", str(timeout_s), host],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
+        pid = os.posix_spawn(
+            _PING_BIN, argv, os.environ, file_actions=_SPAWN_ACTIONS
         )
-        return res.returncode == 0
     except FileNotFoundError:
         logging.error("Brak binarki `ping`. Zainstaluj iputils-ping w obrazie.")
         time.sleep(5)
         return False
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status) == 0
+
+
+_RECEIVED_RE = re.compile(r"(\d+) (?:packets )?received")
+
+
+def ping_multi(
+    host: str, count: int = 3, interval: float = 0.2, timeout_s: int = 1
+) -> int:
+    """
+    Kilka pingów jednym wywołaniem `ping -c count -i interval -q`.
+
+    Zwraca liczbę odebranych odpowiedzi (z podsumowania "X received").
+    """
+    if _PING_BIN is None:
+        logging.error("Brak binarki `ping`. Zainstaluj iputils-ping w obrazie.")
+        return 0
+    # Potrzebne jest wyjście (podsumowanie), więc zamiast posix_spawn
+    # z /dev/null jak w _ping_subprocess – subprocess.run z potokiem.
+    rc, out = run_cmd(
+        [_PING_BIN, "-n", "-q", "-c", str(count), "-i", str(interval),
+         "-W", str(timeout_s), host]
+    )
+    m = _RECEIVED_RE.search(out)
+    return int(m.group(1)) if m else 0
+
+
+async def ping_async(host: str, timeout_s: int = 1) -> bool:
+    """
+    Jednorazowy ping ICMP do hosta: binarka `ping` w wątku (asyncio.to_thread),
+    żeby czekanie na odpowiedź nie blokowało pętli.
+    """
+    return await asyncio.to_thread(_ping_subprocess, host, timeout_s)
+
+
+class IcmpBatcher:
+    """
+    Wysyła echo-request do wielu hostów naraz przez jedno gniazdo ICMP
+    (podobnie jak fping). Gniazdo jest na stałe zarejestrowane w epoll
+    pętli asyncio, więc odpowiedzi odbierane są bez osobnego wątku
+    i bez własnego poll() w każdym cyklu.
+
+    Preferuje nieuprzywilejowane gniazdo DGRAM (Linux, ping_group_range);
+    jako root bez tego uprawnienia używa gniazda RAW.
+    Odpowiedzi dopasowywane są po numerze sekwencji.
+    """
+
+    PAYLOAD = b"auto-net-ping-watch".ljust(32, b"\0")
+
+    def __init__(self):
+        try:
+            self._sock = socket.socket(
+                socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP
+            )
+            self._raw = False
+        except PermissionError:
+            self._sock = socket.socket(
+                socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP
+            )
+            self._raw = True
+        self._sock.setblocking(False)
+        # przy DGRAM identyfikator nadpisuje jądro (port gniazda)
+        self._ident = os.getpid() & 0xFFFF
+        self._seq = 0
+        # szablon pakietu (typ 8, id, payload) z seq=0 i sumą kontrolną 0;
+        # wysyłany od razu po wypełnieniu, więc jeden bufor wystarcza
+        self._template = bytearray(
+            struct.pack("!BBHHH", 8, 0, 0, self._ident, 0) + self.PAYLOAD
+        )
+        self._template_sum = ~self.checksum(self._template) & 0xFFFF
+        # stały bufor odbiorczy – odpowiedzi parsowane w miejscu, bez alokacji
+        self._rbuf = bytearray(2048)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # stan bieżącego cyklu: seq -> host, wyniki, future "wszyscy odpowiedzieli"
+        self._waiting: dict[int, str] = {}
+        self._results: dict[str, bool] = {}
+        self._required_left: set[str] = set()
+        self._any_of: set[str] = set()
+        self._any_hit = False
+        self._done: asyncio.Future | None = None
+
+    @staticmethod
+    def checksum(data: bytes) -> int:
+        """Suma kontrolna internetu (RFC 1071)."""
+        if len(data) % 2:
+            # kopia – nie rozszerzaj bytearray przekazanego przez wołającego
+            data = bytes(data) + b"\0"
+        total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+        while total >> 16:
+            total = (total & 0xFFFF) + (total >> 16)
+        return ~total & 0xFFFF
+
+    def _packet(self, seq: int) -> bytearray:
+        """
+        Echo-request z gotowego szablonu: podmienia tylko seq i sumę kontrolną,
+        którą liczy przyrostowo (suma szablonu + seq) zamiast skanować pakiet.
+        """
+        total = self._template_sum + seq
+        total = (total & 0xFFFF) + (total >> 16)
+        pkt = self._template
+        struct.pack_into("!H", pkt, 2, ~total & 0xFFFF)
+        struct.pack_into("!H", pkt, 6, seq)
+        return pkt
+
+    def _next_seq(self) -> int:
+        self._seq = (self._seq + 1) & 0xFFFF
+        return self._seq
+
+    async def probe(
+        self, hosts: list[str], timeout_s: float, any_of: list[str] = ()
+    ) -> dict[str, bool]:
+        """
+        Pinguj `hosts` i `any_of` jednocześnie; zwraca {host: odpowiedział}.
+
+        Kończy się przed timeoutem, gdy odpowiedzą wszystkie `hosts`
+        i co najmniej jeden z `any_of` – na resztę z `any_of` nie czeka.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            loop.add_reader(self._sock.fileno(), self._on_readable)
+            self._loop = loop
+
+        self._results = results = dict.fromkeys([*hosts, *any_of], False)
+        self._required_left = set(hosts)
+        self._any_of = set(any_of)
+        self._any_hit = not any_of
+        self._waiting = {}
+        for host in results:
+            seq = self._next_seq()
+            try:
+                self._sock.sendto(self._packet(seq), (host, 0))
+            except OSError:
+                # np. brak trasy – host DOWN
+                continue
+            self._waiting[seq] = host
+
+        if self._waiting:
+            self._done = loop.create_future()
+            try:
+                await asyncio.wait_for(self._done, timeout_s)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._done = None
+                self._waiting = {}
+        return results
+
+    def _on_readable(self):
+        """Callback pętli: odbierz wszystkie oczekujące odpowiedzi z gniazda."""
+        buf = self._rbuf
+        while True:
+            try:
+                n, _addr = self._sock.recvfrom_into(buf)
+            except (BlockingIOError, InterruptedError):
+                break
+            off = (buf[0] & 0x0F) * 4 if self._raw else 0  # pomiń nagłówek IP
+            if n - off < 8 or buf[off] != 0:  # 0 = echo reply
+                continue
+            ident, seq = struct.unpack_from("!HH", buf, off + 4)
+            if self._raw and ident != self._ident:
+                continue
+            # spóźnione odpowiedzi z poprzednich cykli są pomijane
+            host = self._waiting.pop(seq, None)
+            if host is not None:
+                self._results[host] = True
+                self._required_left.discard(host)
+                self._any_hit = self._any_hit or host in self._any_of
+        if (
+            self._done is not None
+            and not self._done.done()
+            and not self._required_left
+            and self._any_hit
+        ):
+            self._done.set_result(None)
+
+    def close(self):
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.remove_reader(self._sock.fileno())
+        self._sock.close()
+
+
+def open_icmp_batcher() -> IcmpBatcher | None:
+    """Utwórz IcmpBatcher lub zwróć None, gdy gniazdo ICMP jest niedostępne."""
+    try:
+        return IcmpBatcher()
+    except OSError as e:
+        logging.info("Gniazdo ICMP niedostępne (%s) – ping pojedynczo.", e)
+        return None
+
+
+# Ustawiany w main(); None -> pingi pojedynczo przez binarkę `ping`.
+_BATCHER: IcmpBatcher | None = None
+
+
+# Kontekst TLS (wczytanie magazynu certyfikatów) tworzony raz.
+_SSL_CTX = ssl.create_default_context()
+
+
+class SMTPPool:
+    """
+    Jedno długo żyjące połączenie SMTP współdzielone przez kolejne maile.
+
+    Przed wysyłką sprawdza połączenie przez NOOP; jeśli serwer je zamknął,
+    łączy się ponownie (SSL/STARTTLS + login).
+    """
+
+    def __init__(self):
+        self._conn: smtplib.SMTP | None = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _reconnect(self):
+        self._drop()
+        if SMTP_PORT == 465:
+            conn = smtplib.SMTP_SSL(
+                SMTP_HOST, SMTP_PORT, context=_SSL_CTX, timeout=15
+            )
+        else:
+            conn = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=15)
+        try:
+            if SMTP_PORT != 465:
+                try:
+                    conn.ehlo()
+                    conn.starttls(context=_SSL_CTX)
+                except smtplib.SMTPNotSupportedError:
+                    # Np. lokalny MTA na porcie 25.
+                    pass
+            if SMTP_USER:
+                conn.login(SMTP_USER, SMTP_PASS)
+        except Exception:
+            # nieudany STARTTLS/login – nie zostawiaj otwartego gniazda
+            conn.close()
+            raise
+        self._conn = conn
+
+    def _alive(self) -> bool:
+        if self._conn is None:
+            return False
+        try:
+            return self._conn.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _drop(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def send(self, msg: EmailMessage):
+        with self._lock:
+            if not self._alive():
+                self._reconnect()
+            try:
+                self._conn.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # serwer zamknął połączenie między NOOP a wysyłką
+                self._reconnect()
+                self._conn.send_message(msg)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.quit()
+                except Exception:
+                    pass
+                self._conn = None
+
+
+_POOL = SMTPPool()
 
 
 def send_mail(subject: str, body: str):
     """
-    Wyślij maila tekstowego przez SMTP (STARTTLS/SSL).
+    Wyślij maila tekstowego przez SMTP (STARTTLS/SSL), reużywając połączenia.
     """
     if not MAIL_TO:
         logging.warning("MAIL_TO nie ustawione – pomijam wysyłkę e-maila.")
@@ -139,26 +513,84 @@ def send_mail(subject: str, body: str):
     msg["To"] = ", ".join(MAIL_TO)
     msg.set_content(body)
 
-    if SMTP_PORT == 465:
-        ctx = ssl.create_default_context()
-        with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, context=ctx, timeout=15) as s:
-            if SMTP_USER:
-                s.login(SMTP_USER, SMTP_PASS)
-            s.send_message(msg)
-    else:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=15) as s:
-            try:
-                s.ehlo()
-                s.starttls(context=ssl.create_default_context())
-            except smtplib.SMTPNotSupportedError:
-                # Np. lokalny MTA na porcie 25.
-                pass
-            if SMTP_USER:
-                s.login(SMTP_USER, SMTP_PASS)
-            s.send_message(msg)
+    _POOL.send(msg)
 
 
-def classify_status(router_ip: str | None) -> tuple[bool, str, dict[str, str]]:
+async def _any_ok(coros: list) -> bool:
+    """
+    Czekaj na pierwszy ping zwracający True i anuluj pozostałe.
+    Zwraca False dopiero gdy wszystkie zakończą się porażką.
+    """
+    pending = {asyncio.ensure_future(c) for c in coros}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            if any(t.result() for t in done):
+                return True
+        return False
+    finally:
+        for t in pending:
+            t.cancel()
+
+
+async def _probe_lan(router_ip: str) -> bool:
+    """Sam ping bramy (tryb fail-fast)."""
+    if _BATCHER is not None:
+        res = await _BATCHER.probe([router_ip], PING_TIMEOUT_S)
+        return res[router_ip]
+    return await ping_async(router_ip, PING_TIMEOUT_S)
+
+
+async def _probe_batched(
+    lan: str | None, wan: str | None, public: list[str]
+) -> tuple[bool, bool | None, bool]:
+    """
+    Wszystkie hosty w jednej paczce przez IcmpBatcher; z hostów publicznych
+    wystarczy pierwsza odpowiedź. lan=None: brama już potwierdzona (UP).
+    """
+    required = [h for h in (lan, wan) if h]
+    res = await _BATCHER.probe(required, PING_TIMEOUT_S, any_of=public)
+    lan_ok = res[lan] if lan else True
+    wan_ok = res[wan] if wan else None
+    return lan_ok, wan_ok, any(res[h] for h in public)
+
+
+async def _probe_each(
+    lan: str | None, wan: str | None, public: list[str]
+) -> tuple[bool, bool | None, bool]:
+    """
+    Każdy host osobnym ping_async. Wszystkie pingi startują równocześnie –
+    czas cyklu to max(RTT), a nie suma timeoutów.
+    lan=None: brama już potwierdzona (UP).
+    """
+    lan_task = asyncio.ensure_future(ping_async(lan, PING_TIMEOUT_S)) if lan else None
+    wan_task = (
+        asyncio.ensure_future(ping_async(wan, PING_TIMEOUT_S)) if wan else None
+    )
+    internet_task = asyncio.ensure_future(
+        _any_ok([ping_async(h, PING_TIMEOUT_S) for h in public])
+    )
+
+    lan_ok = await lan_task if lan_task is not None else True
+    if not lan_ok:
+        internet_task.cancel()
+    wan_ok = await wan_task if wan_task is not None else None
+    internet_ok = lan_ok and await internet_task
+    return lan_ok, wan_ok, internet_ok
+
+
+_DIAG_TEMPLATE: dict[str, str] = {
+    "LAN": "DOWN",
+    "WAN": "N/A",
+    "INTERNET": "DOWN",
+}
+
+
+async def classify_status(
+    router_ip: str | None, force_full: bool = False
+) -> tuple[bool, str, dict[str, str]]:
     """
     Zwraca (ok, label, diag) gdzie:
       - ok: bool określający, czy Internet jest dostępny (INTERNET=UP),
@@ -172,6 +604,7 @@ def classify_status(router_ip: str | None) -> tuple[bool, str, dict[str, str]]:
           ping(brama) true   -> LAN = UP
       - WAN (opcjonalny):
           WAN_HOST brak      -> WAN = N/A
+          LAN = DOWN i nie force_full -> WAN = SKIPPED
           ping(WAN_HOST)     -> WAN = UP / DOWN
       - INTERNET:
           jeśli LAN != UP    -> INTERNET = DOWN
@@ -179,17 +612,17 @@ def classify_status(router_ip: str | None) -> tuple[bool, str, dict[str, str]]:
              i ANY ping(PUBLIC_HOSTS) -> INTERNET = UP
              else                     -> INTERNET = DOWN
 
+    force_full=False: najpierw sam ping bramy; gdy nie odpowiada, WAN i hosty
+    publiczne nie są pingowane (fail-fast). force_full=True: wszystkie hosty
+    pingowane równocześnie.
+
     Label:
       - NO_GATEWAY (brak bramy),
       - LAN_DOWN (brama nie odpowiada),
       - UP (Internet działa),
       - INTERNET_DOWN (brama OK, Internet nie działa).
     """
-    diag: dict[str, str] = {
-        "LAN": "DOWN",
-        "WAN": "N/A",
-        "INTERNET": "DOWN",
-    }
+    diag = _DIAG_TEMPLATE.copy()
 
     # LAN
     if not router_ip:
@@ -197,20 +630,36 @@ def classify_status(router_ip: str | None) -> tuple[bool, str, dict[str, str]]:
         # przy braku bramy WAN/INTERNET i tak są DOWN/N/A
         return False, "NO_GATEWAY", diag
 
-    lan_ok = ping_once(router_ip, PING_TIMEOUT_S)
-    diag["LAN"] = "UP" if lan_ok else "DOWN"
-
-    # WAN (opcjonalnie)
-    if WAN_HOST:
-        wan_ok = ping_once(WAN_HOST, PING_TIMEOUT_S)
-        diag["WAN"] = "UP" if wan_ok else "DOWN"
+    lan_target = router_ip
+    if not force_full:
+        if not await _probe_lan(router_ip):
+            if WAN_HOST:
+                diag["WAN"] = "SKIPPED"
+            return False, "LAN_DOWN", diag
+        lan_target = None  # brama już potwierdzona
+
+    # nazwy rozwiązywane równolegle; nierozwiązane hosty są DOWN bez pingu
+    names = [WAN_HOST, *PUBLIC_HOSTS] if WAN_HOST else list(PUBLIC_HOSTS)
+    ips = await asyncio.gather(*(resolve(h) for h in names))
+    wan_target = ips.pop(0) if WAN_HOST else None
+    public_targets = [ip for ip in ips if ip]
+    if _BATCHER is not None:
+        lan_ok, wan_ok, internet_ok = await _probe_batched(
+            lan_target, wan_target, public_targets
+        )
     else:
-        diag["WAN"] = "N/A"
+        lan_ok, wan_ok, internet_ok = await _probe_each(
+            lan_target, wan_target, public_targets
+        )
 
+    if WAN_HOST and wan_target is None:
+        wan_ok = False  # nazwy WAN_HOST nie udało się rozwiązać
+
+    diag["LAN"] = "UP" if lan_ok else "DOWN"
+    # WAN (opcjonalnie)
+    diag["WAN"] = "N/A" if wan_ok is None else ("UP" if wan_ok else "DOWN")
     # INTERNET – tylko jeśli LAN jest UP
-    internet_ok = False
-    if lan_ok:
-        internet_ok = any(ping_once(h, PING_TIMEOUT_S) for h in PUBLIC_HOSTS)
+    internet_ok = lan_ok and internet_ok
     diag["INTERNET"] = "UP" if internet_ok else "DOWN"
 
     # label / ok
@@ -228,105 +677,126 @@ def format_diag(diag: dict[str, str]) -> str:
     return f"LAN={diag['LAN']}, WAN={diag['WAN']}, INTERNET={diag['INTERNET']}"
 
 
-def main():
+async def notify(subject: str, body: str):
+    """Wyślij e-mail w wątku, żeby wolny serwer SMTP nie blokował pętli."""
+    try:
+        await asyncio.to_thread(send_mail, subject, body)
+        logging.info("Wysłano e-mail: %s", subject)
+    except Exception as e:
+        logging.error("Błąd wysyłki e-maila: %s", e)
+
+
+async def main_async():
     """
     Główna pętla monitorująca.
     """
+    global _BATCHER
     logging.info("Auto Ping Watch — start (Docker, LAN+WAN+Internet)")
+    _BATCHER = open_icmp_batcher()
+    if _BATCHER is not None:
+        logging.info("Implementacja pingu: IcmpBatcher (jedno gniazdo ICMP)")
+    else:
+        logging.info("Implementacja pingu: binarka `ping` (osobno dla hosta)")
     router_ip = discover_default_gateway()
     if router_ip:
-        logging.info(f"Wykryta brama (router): {router_ip}")
+        logging.info("Wykryta brama (router): %s", router_ip)
     else:
         logging.warning("Nie wykryto bramy. Spróbuję ponownie w trakcie pracy.")
 
     if WAN_HOST:
-        logging.info(f"WAN host (self-check): {WAN_HOST}")
+        logging.info("WAN host (self-check): %s", WAN_HOST)
     else:
         logging.info("WAN host (ANPW_WAN_HOST) nie ustawiony – pomijam ten test.")
 
     consecutive_fail = 0
     consecutive_ok = 0
     in_outage = False
-    outage_start_ts = None
+    # czas trwania liczony zegarem monotonicznym (odporny na NTP),
+    # czas ścienny tylko do wyświetlenia w mailu
+    outage_start_monotonic = None
+    outage_start_wall = None
     outage_kind = None
-    last_router_check = 0.0
+    outage_ticks = 0
+    last_router_check = time.monotonic()
+    mail_tasks: set[asyncio.Task] = set()
+
+    def send_in_background(subject: str, body: str):
+        task = asyncio.create_task(notify(subject, body))
+        mail_tasks.add(task)
+        task.add_done_callback(mail_tasks.discard)
 
     while True:
-        now_ts = time.time()
+        # jeden odczyt zegara na cykl – także dla startu/końca przerwy
+        now_mono = time.monotonic()
         # okresowe ponowne wykrywanie bramy
-        if now_ts - last_router_check >= ROUTER_REDISCOVER_EVERY or router_ip is None:
+        if now_mono - last_router_check >= ROUTER_REDISCOVER_EVERY or router_ip is None:
             new_router = discover_default_gateway()
-            last_router_check = now_ts
+            last_router_check = now_mono
             if new_router and new_router != router_ip:
-                logging.info(f"Zmieniono wykrytą bramę: {router_ip} -> {new_router}")
+                logging.info("Zmieniono wykrytą bramę: %s -> %s", router_ip, new_router)
                 router_ip = new_router
             elif router_ip is None and new_router:
-                logging.info(f"Wykryto bramę: {new_router}")
+                logging.info("Wykryto bramę: %s", new_router)
                 router_ip = new_router
 
-        ok, kind, diag = classify_status(router_ip)
+        # w trakcie przerwy pełny zestaw pingów tylko co N-ty cykl
+        force_full = not in_outage or outage_ticks % OUTAGE_FULL_PROBE_EVERY == 0
+        ok, kind, diag = await classify_status(router_ip, force_full)
+        outage_ticks = outage_ticks + 1 if in_outage else 0
 
         if ok:
             consecutive_ok += 1
             consecutive_fail = 0
             if in_outage and consecutive_ok >= OK_THRESHOLD:
-                duration = time.time() - outage_start_ts
-                end_str = now_local()
-                start_str = (
-                    datetime.fromtimestamp(outage_start_ts)
-                    .astimezone()
-                    .strftime("%Y-%m-%d %H:%M:%S %Z")
-                )
-                subject = f"[AUTO-PING] Koniec przerwy ({fmt_dur(duration)})"
+                duration = fmt_dur(now_mono - outage_start_monotonic)
+                end_str = fmt_ts(time.time())
+                start_str = fmt_ts(outage_start_wall)
+                subject = f"[AUTO-PING] Koniec przerwy ({duration})"
                 body = (
                     "Raport przerwy w dostępie do Internetu (ICMP)\n\n"
                     f"Rodzaj przerwy: {outage_kind}\n"
                     f"Przerwa rozpoczęła się: {start_str}\n"
                     f"Przerwa zakończyła się: {end_str}\n"
-                    f"Czas trwania: {fmt_dur(duration)}\n\n"
+                    f"Czas trwania: {duration}\n\n"
                     f"Diagnostyka końcowa: {format_diag(diag)}\n\n"
                     f"Router (brama): {router_ip or 'nieznany'}\n"
-                    f"Cele publiczne: {', '.join(PUBLIC_HOSTS)}\n"
-                    f"Host WAN: {WAN_HOST or 'brak (ANPW_WAN_HOST)'}\n"
-                    f"Progi: FAIL>={FAIL_THRESHOLD}, OK>={OK_THRESHOLD}, interwał={INTERVAL_SEC}s\n"
+                    + _MAIL_FOOTER
                 )
-                try:
-                    send_mail(subject, body)
-                    logging.info(f"Wysłano e-mail: {subject}")
-                except Exception as e:
-                    logging.error(f"Błąd wysyłki e-maila: {e}")
+                send_in_background(subject, body)
                 in_outage = False
-                outage_start_ts = None
+                outage_start_monotonic = None
+                outage_start_wall = None
                 outage_kind = None
         else:
             consecutive_fail += 1
             consecutive_ok = 0
             if not in_outage and consecutive_fail >= FAIL_THRESHOLD:
                 in_outage = True
-                outage_start_ts = time.time()
+                outage_start_monotonic = now_mono
+                outage_start_wall = time.time()
                 outage_kind = kind
                 logging.warning(
-                    f"Wykryto przerwę: {kind} (router={router_ip}, public={PUBLIC_HOSTS}, diag={format_diag(diag)})"
+                    "Wykryto przerwę: %s (router=%s, public=%s, diag=%s)",
+                    kind, router_ip, PUBLIC_HOSTS, format_diag(diag),
                 )
                 if NOTIFY_ON_START:
                     subject = f"[AUTO-PING] Przerwa wykryta: {kind}"
                     body = (
                         "Wykryto przerwę w dostępie do Internetu (ICMP)\n\n"
                         f"Rodzaj przerwy: {kind}\n"
-                        f"Start przerwy: {now_local()}\n"
+                        f"Start przerwy: {fmt_ts(outage_start_wall)}\n"
                         f"Diagnostyka: {format_diag(diag)}\n\n"
                         f"Router (brama): {router_ip or 'nieznany'}\n"
-                        f"Cele publiczne: {', '.join(PUBLIC_HOSTS)}\n"
-                        f"Host WAN: {WAN_HOST or 'brak (ANPW_WAN_HOST)'}\n"
-                        f"Progi: FAIL>={FAIL_THRESHOLD}, OK>={OK_THRESHOLD}, interwał={INTERVAL_SEC}s\n"
+                        + _MAIL_FOOTER
                     )
-                    try:
-                        send_mail(subject, body)
-                        logging.info(f"Wysłano e-mail: {subject}")
-                    except Exception as e:
-                        logging.error(f"Błąd wysyłki e-maila: {e}")
+                    send_in_background(subject, body)
 
-        time.sleep(INTERVAL_SEC)
+        await asyncio.sleep(INTERVAL_SEC)
+
+
+def main():
+    """Punkt wejścia: uruchom pętlę monitorującą w asyncio."""
+    asyncio.run(main_async())
 
 
 if __name__ == "__main__":
@@ -16,9 +16,14 @@ if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
     
 import unittest
-from unittest.mock import patch, MagicMock, call
+from contextlib import contextmanager
+from unittest.mock import patch, MagicMock, AsyncMock, call, mock_open
+import asyncio
 import smtplib
+import socket
+import struct
 import subprocess
+import time
 
 
 # ──────────────────────────────────────────────
@@ -53,6 +58,15 @@ def import_module_with_env(env_overrides=None):
     return m
 
 
+@contextmanager
+def fake_spawn(m, rc=0):
+    """Podmienia os.posix_spawn/os.waitpid; ping kończy się kodem `rc`."""
+    with patch.object(m, "_PING_BIN", "/bin/ping"), \
+         patch("os.posix_spawn", return_value=4242) as mock_spawn, \
+         patch("os.waitpid", return_value=(4242, rc << 8)):
+        yield mock_spawn
+
+
 # ══════════════════════════════════════════════
 # 1. fmt_dur – formatowanie czasu trwania
 # ══════════════════════════════════════════════
@@ -88,6 +102,24 @@ class TestFmtDur(unittest.TestCase):
         self.assertEqual(self.m.fmt_dur(91815), "25h 30m 15s")
 
 
+class TestFmtTs(unittest.TestCase):
+
+    def setUp(self):
+        self.m = import_module_with_env()
+
+    def test_matches_datetime_formatting(self):
+        from datetime import datetime
+        ts = 1_700_000_000.0
+        expected = datetime.fromtimestamp(ts).astimezone().strftime(
+            "%Y-%m-%d %H:%M:%S %Z"
+        )
+        self.assertEqual(self.m.fmt_ts(ts), expected)
+
+    def test_now_local_uses_current_time(self):
+        with patch("time.time", return_value=1_700_000_000.0):
+            self.assertEqual(self.m.now_local(), self.m.fmt_ts(1_700_000_000.0))
+
+
 # ══════════════════════════════════════════════
 # 2. discover_default_gateway
 # ══════════════════════════════════════════════
@@ -99,7 +131,8 @@ class TestDiscoverDefaultGateway(unittest.TestCase):
     def _run(self, stdout, rc=0):
         """Pomocnik: podmień run_cmd i wywołaj discover_default_gateway."""
         mock_result = MagicMock(returncode=rc, stdout=stdout)
-        with patch("subprocess.run", return_value=mock_result):
+        with patch("subprocess.run", return_value=mock_result), \
+             patch.object(self.m, "discover_default_gateway_procfs", return_value=None):
             return self.m.discover_default_gateway()
 
     def test_standard_output(self):
@@ -128,48 +161,195 @@ class TestDiscoverDefaultGateway(unittest.TestCase):
         )
         self.assertEqual(self._run(out), "192.168.100.1")
 
+    def test_default_route_without_via_skipped(self):
+        out = (
+            "default dev ppp0 scope link\n"
+            "default via 10.0.0.1 dev eth0\n"
+        )
+        self.assertEqual(self._run(out), "10.0.0.1")
+
+    def test_falls_back_to_full_route_table(self):
+        results = [
+            MagicMock(returncode=0, stdout=""),
+            MagicMock(returncode=0, stdout="default via 172.16.0.1 dev eth1\n"),
+        ]
+        with patch("subprocess.run", side_effect=results) as mock_run, \
+             patch.object(self.m, "discover_default_gateway_procfs", return_value=None):
+            self.assertEqual(self.m.discover_default_gateway(), "172.16.0.1")
+        self.assertEqual(
+            [c.args[0] for c in mock_run.call_args_list],
+            [["ip", "-4", "-o", "route", "list", "default"], ["ip", "-o", "route"]],
+        )
+
+    def test_procfs_result_skips_ip_command(self):
+        with patch.object(self.m, "discover_default_gateway_procfs",
+                          return_value="10.0.0.1"), \
+             patch("subprocess.run") as mock_run:
+            self.assertEqual(self.m.discover_default_gateway(), "10.0.0.1")
+        mock_run.assert_not_called()
+
+
+class TestDiscoverDefaultGatewayProcfs(unittest.TestCase):
+
+    HEADER = "Iface\tDestination\tGateway \tFlags\tRefCnt\tUse\tMetric\tMask\n"
+
+    def setUp(self):
+        self.m = import_module_with_env()
+
+    def _run(self, content):
+        with patch("builtins.open", mock_open(read_data=content)):
+            return self.m.discover_default_gateway_procfs()
+
+    def test_default_route(self):
+        content = self.HEADER + (
+            "eth0\t0000A8C0\t00000000\t0001\t0\t0\t0\t00FFFFFF\n"
+            "eth0\t00000000\t0101A8C0\t0003\t0\t0\t0\t00000000\n"
+        )
+        self.assertEqual(self._run(content), "192.168.1.1")
+
+    def test_gateway_in_host_byte_order(self):
+        # jądro wypisuje adres w kolejności bajtów hosta (także na big-endian)
+        gw_hex = "%08X" % struct.unpack("=L", socket.inet_aton("10.0.0.138"))[0]
+        content = self.HEADER + f"eth0\t00000000\t{gw_hex}\t0003\t0\t0\t0\t00000000\n"
+        self.assertEqual(self._run(content), "10.0.0.138")
+
+    def test_default_route_without_gateway_flag(self):
+        content = self.HEADER + "eth0\t00000000\t00000000\t0001\t0\t0\t0\t00000000\n"
+        self.assertIsNone(self._run(content))
+
+    def test_no_default_route(self):
+        content = self.HEADER + "eth0\t0000A8C0\t00000000\t0001\t0\t0\t0\t00FFFFFF\n"
+        self.assertIsNone(self._run(content))
+
+    def test_missing_file(self):
+        with patch("builtins.open", side_effect=FileNotFoundError):
+            self.assertIsNone(self.m.discover_default_gateway_procfs())
+
 
 # ══════════════════════════════════════════════
-# 3. ping_once
+# 3. _ping_subprocess
 # ══════════════════════════════════════════════
-class TestPingOnce(unittest.TestCase):
+class TestPingSubprocess(unittest.TestCase):
 
     def setUp(self):
         self.m = import_module_with_env()
 
     def test_ping_success(self):
-        mock_result = MagicMock(returncode=0)
-        with patch("subprocess.run", return_value=mock_result):
-            self.assertTrue(self.m.ping_once("8.8.8.8"))
+        with fake_spawn(self.m, rc=0):
+            self.assertTrue(self.m._ping_subprocess("8.8.8.8", 1))
 
     def test_ping_failure(self):
-        mock_result = MagicMock(returncode=1)
-        with patch("subprocess.run", return_value=mock_result):
-            self.assertFalse(self.m.ping_once("8.8.8.8"))
+        with fake_spawn(self.m, rc=1):
+            self.assertFalse(self.m._ping_subprocess("8.8.8.8", 1))
 
     def test_ping_binary_missing(self):
-        with patch("subprocess.run", side_effect=FileNotFoundError), \
+        with patch.object(self.m, "_PING_BIN", None), \
+             patch("os.posix_spawn") as mock_spawn, \
              patch("time.sleep") as mock_sleep:
-            result = self.m.ping_once("8.8.8.8")
+            result = self.m._ping_subprocess("8.8.8.8", 1)
         self.assertFalse(result)
+        mock_spawn.assert_not_called()
+        mock_sleep.assert_called_once_with(5)
+
+    def test_ping_binary_removed_after_start(self):
+        with patch.object(self.m, "_PING_BIN", "/bin/ping"), \
+             patch("os.posix_spawn", side_effect=FileNotFoundError), \
+             patch("time.sleep") as mock_sleep:
+            self.assertFalse(self.m._ping_subprocess("8.8.8.8", 1))
         mock_sleep.assert_called_once_with(5)
 
     def test_passes_timeout_to_command(self):
-        mock_result = MagicMock(returncode=0)
-        with patch("subprocess.run", return_value=mock_result) as mock_run:
-            self.m.ping_once("1.1.1.1", timeout_s=3)
-        args = mock_run.call_args[0][0]
+        with fake_spawn(self.m) as mock_spawn:
+            self.m._ping_subprocess("1.1.1.1", 3)
+        args = mock_spawn.call_args[0][1]
         self.assertIn("3", args)
 
     def test_uses_correct_flags(self):
-        mock_result = MagicMock(returncode=0)
-        with patch("subprocess.run", return_value=mock_result) as mock_run:
-            self.m.ping_once("1.2.3.4")
-        cmd = mock_run.call_args[0][0]
+        with fake_spawn(self.m) as mock_spawn:
+            self.m._ping_subprocess("1.2.3.4", 1)
+        cmd = mock_spawn.call_args[0][1]
         self.assertIn("-c", cmd)
         self.assertIn("1", cmd)
         self.assertIn("-n", cmd)
 
+    def test_output_redirected_to_devnull(self):
+        with fake_spawn(self.m) as mock_spawn:
+            self.m._ping_subprocess("1.2.3.4", 1)
+        actions = mock_spawn.call_args.kwargs["file_actions"]
+        self.assertEqual({a[2] for a in actions}, {1, 2})
+
+    def test_ping_count_uses_ping_multi(self):
+        m = import_module_with_env({"ANPW_PING_COUNT": "3"})
+        with patch.object(m, "_PING_BIN", "/bin/ping"), \
+             patch.object(m, "ping_multi", return_value=1) as mock_multi, \
+             patch("os.posix_spawn") as mock_spawn:
+            self.assertTrue(m._ping_subprocess("8.8.8.8", 2))
+        mock_spawn.assert_not_called()
+        mock_multi.assert_called_once_with("8.8.8.8", 3, timeout_s=2)
+
+
+class TestPingMulti(unittest.TestCase):
+
+    def setUp(self):
+        self.m = import_module_with_env()
+
+    def _run(self, stdout, rc=0):
+        mock_result = MagicMock(returncode=rc, stdout=stdout)
+        with patch.object(self.m, "_PING_BIN", "/bin/ping"), \
+             patch("subprocess.run", return_value=mock_result) as mock_run:
+            return self.m.ping_multi("8.8.8.8", count=3), mock_run
+
+    def test_partial_loss(self):
+        out = (
+            "--- 8.8.8.8 ping statistics ---\n"
+            "3 packets transmitted, 2 received, 33.3333% packet loss, time 402ms\n"
+        )
+        received, _ = self._run(out)
+        self.assertEqual(received, 2)
+
+    def test_total_loss(self):
+        out = "3 packets transmitted, 0 received, 100% packet loss, time 2040ms\n"
+        received, _ = self._run(out, rc=1)
+        self.assertEqual(received, 0)
+
+    def test_busybox_summary(self):
+        out = "3 packets transmitted, 3 packets received, 0% packet loss\n"
+        received, _ = self._run(out)
+        self.assertEqual(received, 3)
+
+    def test_unparsable_output(self):
+        received, _ = self._run("ping: unknown host", rc=2)
+        self.assertEqual(received, 0)
+
+    def test_command_flags(self):
+        _, mock_run = self._run("1 received")
+        cmd = mock_run.call_args[0][0]
+        self.assertEqual(cmd[0], "/bin/ping")
+        self.assertEqual(cmd[cmd.index("-c") + 1], "3")
+        self.assertEqual(cmd[cmd.index("-i") + 1], "0.2")
+        self.assertIn("-q", cmd)
+
+    def test_ping_binary_missing(self):
+        with patch.object(self.m, "_PING_BIN", None), \
+             patch("subprocess.run") as mock_run:
+            self.assertEqual(self.m.ping_multi("8.8.8.8", count=3), 0)
+        mock_run.assert_not_called()
+
+
+class TestPingAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.m = import_module_with_env()
+
+    def test_runs_ping_binary_in_thread(self):
+        with fake_spawn(self.m, rc=0) as mock_spawn:
+            self.assertTrue(asyncio.run(self.m.ping_async("8.8.8.8")))
+        mock_spawn.assert_called_once()
+
+    def test_failed_ping_reports_down(self):
+        with fake_spawn(self.m, rc=1):
+            self.assertFalse(asyncio.run(self.m.ping_async("8.8.8.8", timeout_s=2)))
+
 
 # ══════════════════════════════════════════════
 # 4. classify_status – kluczowa logika
@@ -181,7 +361,7 @@ class TestClassifyStatus(unittest.TestCase):
 
     def _classify(self, router_ip, lan_up, wan_result=None, internet_results=None):
         """
-        Pomocnik: podmienia ping_once i wywołuje classify_status.
+        Pomocnik: podmienia ping_async i wywołuje classify_status.
         internet_results: lista bool dla kolejnych hostów publicznych.
         """
         def fake_ping(host, timeout_s=1):
@@ -193,17 +373,25 @@ class TestClassifyStatus(unittest.TestCase):
                 return internet_results.pop(0)
             return False
 
-        with patch.object(self.m, "ping_once", side_effect=fake_ping):
-            return self.m.classify_status(router_ip)
+        with patch.object(self.m, "ping_async", AsyncMock(side_effect=fake_ping)):
+            return asyncio.run(self.m.classify_status(router_ip))
 
     # --- brak bramy ---
     def test_no_gateway(self):
-        ok, label, diag = self.m.classify_status(None)
+        ok, label, diag = asyncio.run(self.m.classify_status(None))
         self.assertFalse(ok)
         self.assertEqual(label, "NO_GATEWAY")
         self.assertEqual(diag["LAN"], "NO_GATEWAY")
         self.assertEqual(diag["INTERNET"], "DOWN")
 
+    # --- diag jest świeżą kopią, szablon pozostaje nietknięty ---
+    def test_diag_template_not_mutated(self):
+        ok, label, diag = asyncio.run(self.m.classify_status(None))
+        self.assertIsNot(diag, self.m._DIAG_TEMPLATE)
+        self.assertEqual(
+            self.m._DIAG_TEMPLATE, {"LAN": "DOWN", "WAN": "N/A", "INTERNET": "DOWN"}
+        )
+
     # --- LAN DOWN ---
     def test_lan_down(self):
         ok, label, diag = self._classify("192.168.1.1", lan_up=False)
@@ -252,8 +440,9 @@ class TestClassifyStatus(unittest.TestCase):
                 return True
             return True  # publiczne
 
-        with patch.object(m, "ping_once", side_effect=fake_ping):
-            ok, label, diag = m.classify_status("192.168.1.1")
+        with patch.object(m, "ping_async", AsyncMock(side_effect=fake_ping)), \
+             patch.object(m, "resolve", AsyncMock(side_effect=lambda h: h)):
+            ok, label, diag = asyncio.run(m.classify_status("192.168.1.1"))
 
         self.assertEqual(diag["WAN"], "UP")
         self.assertTrue(ok)
@@ -269,28 +458,122 @@ class TestClassifyStatus(unittest.TestCase):
                 return False
             return True
 
-        with patch.object(m, "ping_once", side_effect=fake_ping):
-            ok, label, diag = m.classify_status("192.168.1.1")
+        with patch.object(m, "ping_async", AsyncMock(side_effect=fake_ping)), \
+             patch.object(m, "resolve", AsyncMock(side_effect=lambda h: h)):
+            ok, label, diag = asyncio.run(m.classify_status("192.168.1.1"))
+
+        self.assertEqual(diag["WAN"], "DOWN")
+
+    # --- WAN DOWN bez pingu, gdy nazwy nigdy nie udało się rozwiązać ---
+    def test_wan_down_when_unresolved(self):
+        m = import_module_with_env({"ANPW_WAN_HOST": "myhome.duckdns.org"})
+        fake_resolve = AsyncMock(side_effect=lambda h: None if "duckdns" in h else h)
+        fake_ping = AsyncMock(return_value=True)
+
+        with patch.object(m, "ping_async", fake_ping), \
+             patch.object(m, "resolve", fake_resolve):
+            ok, label, diag = asyncio.run(m.classify_status("192.168.1.1"))
 
         self.assertEqual(diag["WAN"], "DOWN")
+        self.assertTrue(ok)
+        pinged = [c.args[0] for c in fake_ping.call_args_list]
+        self.assertNotIn(None, pinged)
+        self.assertNotIn("myhome.duckdns.org", pinged)
 
-    # --- any() zatrzymuje się na pierwszym True (optymalizacja) ---
+    # --- nierozwiązany host publiczny nie jest pingowany ---
+    def test_unresolved_public_host_not_pinged(self):
+        m = import_module_with_env({"ANPW_PUBLIC": "nope.invalid,8.8.8.8"})
+        fake_resolve = AsyncMock(side_effect=lambda h: None if h == "nope.invalid" else h)
+        fake_ping = AsyncMock(return_value=True)
+
+        with patch.object(m, "ping_async", fake_ping), \
+             patch.object(m, "resolve", fake_resolve):
+            ok, label, diag = asyncio.run(m.classify_status("192.168.1.1"))
+
+        self.assertTrue(ok)
+        pinged = [c.args[0] for c in fake_ping.call_args_list]
+        self.assertEqual(sorted(pinged), ["192.168.1.1", "8.8.8.8"])
+
+    # --- pierwszy udany host publiczny kończy cykl (optymalizacja) ---
     def test_short_circuit_on_first_public_success(self):
-        call_count = []
+        cancelled = []
 
-        def fake_ping(host, timeout_s=1):
-            if host == "192.168.1.1":
+        async def fake_ping(host, timeout_s=1):
+            if host in ("192.168.1.1", "1.1.1.1"):
                 return True
-            call_count.append(host)
-            return True  # pierwszy publiczny odpowiada
+            try:
+                await asyncio.sleep(5)  # pozostałe hosty "wiszą"
+            except asyncio.CancelledError:
+                cancelled.append(host)
+                raise
+            return False
 
         m = import_module_with_env({"ANPW_PUBLIC": "1.1.1.1,8.8.8.8,9.9.9.9"})
-        with patch.object(m, "ping_once", side_effect=fake_ping):
-            ok, label, diag = m.classify_status("192.168.1.1")
+        with patch.object(m, "ping_async", side_effect=fake_ping):
+            start = time.monotonic()
+            ok, label, diag = asyncio.run(m.classify_status("192.168.1.1"))
+            elapsed = time.monotonic() - start
+
+        self.assertTrue(ok)
+        # nie czekamy na wolne hosty publiczne – są anulowane
+        self.assertLess(elapsed, 2)
+        self.assertEqual(sorted(cancelled), ["8.8.8.8", "9.9.9.9"])
+
+    # --- pingi wykonywane są równolegle, nie sekwencyjnie ---
+    def test_probes_run_concurrently(self):
+        m = import_module_with_env({"ANPW_PUBLIC": "1.1.1.1,8.8.8.8"})
+        in_flight = []
+        peak = []
+
+        async def fake_ping(host, timeout_s=1):
+            in_flight.append(host)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.05)
+            in_flight.remove(host)
+            return host != "1.1.1.1"
+
+        with patch.object(m, "ping_async", side_effect=fake_ping):
+            ok, label, diag = asyncio.run(
+                m.classify_status("192.168.1.1", force_full=True)
+            )
+
+        self.assertTrue(ok)
+        self.assertEqual(diag["LAN"], "UP")
+        self.assertEqual(max(peak), 3)
+
+    # --- fail-fast: brama nie odpowiada -> bez pingów WAN/Internet ---
+    def test_lan_down_skips_other_probes(self):
+        m = import_module_with_env({"ANPW_WAN_HOST": "5.6.7.8"})
+        fake = AsyncMock(return_value=False)
+        with patch.object(m, "ping_async", fake):
+            ok, label, diag = asyncio.run(m.classify_status("192.168.1.1"))
+
+        self.assertEqual(label, "LAN_DOWN")
+        self.assertEqual(diag, {"LAN": "DOWN", "WAN": "SKIPPED", "INTERNET": "DOWN"})
+        fake.assert_awaited_once()
+
+    def test_lan_up_probes_rest_without_repinging_gateway(self):
+        fake = AsyncMock(return_value=True)
+        with patch.object(self.m, "ping_async", fake):
+            ok, label, diag = asyncio.run(self.m.classify_status("192.168.1.1"))
 
         self.assertTrue(ok)
-        # any() powinno wywołać ping tylko dla pierwszego hosta publicznego
-        self.assertEqual(len(call_count), 1)
+        hosts = [c.args[0] for c in fake.await_args_list]
+        self.assertEqual(hosts.count("192.168.1.1"), 1)
+
+    def test_force_full_probes_wan_when_lan_down(self):
+        m = import_module_with_env({"ANPW_WAN_HOST": "5.6.7.8"})
+
+        async def fake_ping(host, timeout_s=1):
+            return host == "5.6.7.8"
+
+        with patch.object(m, "ping_async", side_effect=fake_ping):
+            ok, label, diag = asyncio.run(
+                m.classify_status("192.168.1.1", force_full=True)
+            )
+
+        self.assertEqual(label, "LAN_DOWN")
+        self.assertEqual(diag["WAN"], "UP")
 
 
 # ══════════════════════════════════════════════
@@ -384,6 +667,87 @@ class TestSendMail(unittest.TestCase):
 
         mock_smtp_instance.send_message.assert_called_once()
 
+    def test_ssl_context_created_once(self):
+        m = import_module_with_env({"ANPW_SMTP_PORT": "587"})
+        stale, fresh = MagicMock(), MagicMock()
+        stale.noop.side_effect = smtplib.SMTPServerDisconnected
+
+        with patch("smtplib.SMTP", side_effect=[stale, fresh]), \
+             patch("ssl.create_default_context") as mock_ctx:
+            m.send_mail("Pierwszy", "a")
+            m.send_mail("Drugi", "b")
+
+        mock_ctx.assert_not_called()
+        self.assertIs(fresh.starttls.call_args.kwargs["context"], m._SSL_CTX)
+
+    def test_connection_reused_between_mails(self):
+        m = import_module_with_env({"ANPW_SMTP_PORT": "587"})
+        conn = MagicMock()
+        conn.noop.return_value = (250, b"OK")
+
+        with patch("smtplib.SMTP", return_value=conn) as mock_smtp:
+            m.send_mail("Pierwszy", "a")
+            m.send_mail("Drugi", "b")
+
+        mock_smtp.assert_called_once()
+        conn.login.assert_called_once()
+        self.assertEqual(conn.send_message.call_count, 2)
+
+    def test_reconnects_when_noop_fails(self):
+        m = import_module_with_env({"ANPW_SMTP_PORT": "587"})
+        stale, fresh = MagicMock(), MagicMock()
+        stale.noop.side_effect = smtplib.SMTPServerDisconnected
+
+        with patch("smtplib.SMTP", side_effect=[stale, fresh]) as mock_smtp:
+            m.send_mail("Pierwszy", "a")
+            m.send_mail("Drugi", "b")
+
+        self.assertEqual(mock_smtp.call_count, 2)
+        stale.send_message.assert_called_once()
+        fresh.send_message.assert_called_once()
+
+    def test_reconnects_when_disconnected_during_send(self):
+        m = import_module_with_env({"ANPW_SMTP_PORT": "587"})
+        stale, fresh = MagicMock(), MagicMock()
+        stale.send_message.side_effect = smtplib.SMTPServerDisconnected
+
+        with patch("smtplib.SMTP", side_effect=[stale, fresh]):
+            m.send_mail("Temat", "Treść")
+
+        fresh.send_message.assert_called_once()
+
+    def test_failed_login_closes_new_connection(self):
+        m = import_module_with_env({"ANPW_SMTP_PORT": "587"})
+        conn = MagicMock()
+        conn.login.side_effect = smtplib.SMTPAuthenticationError(535, b"bad")
+
+        with patch("smtplib.SMTP", return_value=conn):
+            with self.assertRaises(smtplib.SMTPAuthenticationError):
+                m.send_mail("Temat", "Treść")
+
+        conn.close.assert_called_once()
+        self.assertIsNone(m._POOL._conn)
+
+    def test_failed_starttls_closes_new_connection(self):
+        m = import_module_with_env({"ANPW_SMTP_PORT": "587"})
+        conn = MagicMock()
+        conn.starttls.side_effect = smtplib.SMTPResponseException(454, b"TLS n/a")
+
+        with patch("smtplib.SMTP", return_value=conn):
+            with self.assertRaises(smtplib.SMTPResponseException):
+                m.send_mail("Temat", "Treść")
+
+        conn.close.assert_called_once()
+        self.assertIsNone(m._POOL._conn)
+
+    def test_close_quits_connection(self):
+        m = import_module_with_env({"ANPW_SMTP_PORT": "587"})
+        conn = MagicMock()
+        with patch("smtplib.SMTP", return_value=conn):
+            m.send_mail("Temat", "Treść")
+        m._POOL.close()
+        conn.quit.assert_called_once()
+
 
 # ══════════════════════════════════════════════
 # 7. Logika progów w pętli głównej (thresholds)
@@ -474,11 +838,11 @@ class TestEnvConfig(unittest.TestCase):
 
     def test_public_hosts_parsed_correctly(self):
         m = import_module_with_env({"ANPW_PUBLIC": "1.1.1.1, 8.8.8.8 , 9.9.9.9"})
-        self.assertEqual(m.PUBLIC_HOSTS, ["1.1.1.1", "8.8.8.8", "9.9.9.9"])
+        self.assertEqual(m.PUBLIC_HOSTS, ("1.1.1.1", "8.8.8.8", "9.9.9.9"))
 
     def test_single_public_host(self):
         m = import_module_with_env({"ANPW_PUBLIC": "1.1.1.1"})
-        self.assertEqual(m.PUBLIC_HOSTS, ["1.1.1.1"])
+        self.assertEqual(m.PUBLIC_HOSTS, ("1.1.1.1",))
 
     def test_mail_to_multiple_recipients(self):
         m = import_module_with_env({"ANPW_MAIL_TO": "a@x.com, b@x.com"})
@@ -504,6 +868,349 @@ class TestEnvConfig(unittest.TestCase):
         m = import_module_with_env({"ANPW_WAN_HOST": "home.example.com"})
         self.assertEqual(m.WAN_HOST, "home.example.com")
 
+    def test_outage_full_probe_every_zero_clamped_to_one(self):
+        m = import_module_with_env({"ANPW_OUTAGE_FULL_PROBE_EVERY": "0"})
+        self.assertEqual(m.OUTAGE_FULL_PROBE_EVERY, 1)
+
+    def test_mail_footer_built_from_config(self):
+        m = import_module_with_env({"ANPW_WAN_HOST": "home.example.com"})
+        self.assertIn("Cele publiczne: 1.1.1.1, 8.8.8.8", m._MAIL_FOOTER)
+        self.assertIn("Host WAN: home.example.com", m._MAIL_FOOTER)
+        self.assertIn("FAIL>=3, OK>=2, interwał=5s", m._MAIL_FOOTER)
+
+
+# ══════════════════════════════════════════════
+# 9. resolve – cache DNS z TTL
+# ══════════════════════════════════════════════
+class TestResolve(unittest.TestCase):
+
+    def setUp(self):
+        self.m = import_module_with_env()
+
+    @staticmethod
+    def _addrinfo(ip):
+        return [(2, 1, 6, "", (ip, 0))]
+
+    def _resolve(self, host, **kw):
+        return asyncio.run(self.m.resolve(host, **kw))
+
+    def test_resolves_hostname_to_ip(self):
+        with patch("socket.getaddrinfo", return_value=self._addrinfo("1.2.3.4")):
+            self.assertEqual(self._resolve("home.example.com"), "1.2.3.4")
+
+    def test_uses_cache_within_ttl(self):
+        with patch("socket.getaddrinfo", return_value=self._addrinfo("1.2.3.4")) as gai:
+            self._resolve("home.example.com")
+            self._resolve("home.example.com")
+        gai.assert_called_once()
+
+    def test_refreshes_after_ttl(self):
+        with patch("socket.getaddrinfo", return_value=self._addrinfo("1.2.3.4")) as gai, \
+             patch("time.time", side_effect=[1000.0, 1000.0 + 901]):
+            self._resolve("home.example.com", ttl=900)
+            self._resolve("home.example.com", ttl=900)
+        self.assertEqual(gai.call_count, 2)
+
+    def test_dns_error_never_resolved_returns_none(self):
+        with patch("socket.getaddrinfo", side_effect=socket.gaierror):
+            self.assertIsNone(self._resolve("nope.invalid"))
+
+    def test_dns_error_after_ttl_keeps_last_known_ip(self):
+        with patch("socket.getaddrinfo",
+                   side_effect=[self._addrinfo("1.2.3.4"), socket.gaierror]), \
+             patch("time.time", side_effect=[1000.0, 1000.0 + 901]):
+            self._resolve("home.example.com", ttl=900)
+            self.assertEqual(self._resolve("home.example.com", ttl=900), "1.2.3.4")
+
+    def test_dns_error_not_retried_before_retry_interval(self):
+        with patch("socket.getaddrinfo",
+                   side_effect=[self._addrinfo("1.2.3.4"), socket.gaierror]) as gai, \
+             patch("time.time", side_effect=[1000.0, 1901.0, 1902.0, 1903.0]):
+            self._resolve("home.example.com", ttl=900)
+            self._resolve("home.example.com", ttl=900)
+            self.assertEqual(self._resolve("home.example.com", ttl=900), "1.2.3.4")
+            self.assertEqual(self._resolve("home.example.com", ttl=900), "1.2.3.4")
+        self.assertEqual(gai.call_count, 2)
+
+    def test_lookups_do_not_block_loop(self):
+        def slow_gai(host, *args, **kwargs):
+            time.sleep(0.2)
+            return self._addrinfo("1.2.3.4")
+
+        async def resolve_all():
+            return await asyncio.gather(
+                *(self.m.resolve(f"h{i}.example.com") for i in range(3))
+            )
+
+        start = time.monotonic()
+        with patch("socket.getaddrinfo", side_effect=slow_gai):
+            ips = asyncio.run(resolve_all())
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(ips, ["1.2.3.4"] * 3)
+
+
+# ══════════════════════════════════════════════
+# 10. IcmpBatcher – wiele pingów przez jedno gniazdo
+# ══════════════════════════════════════════════
+class FakeIcmpSocket:
+    """
+    Gniazdo ICMP odpowiadające echo-reply tylko wybranym hostom.
+    Gotowość do odczytu sygnalizowana przez socketpair (prawdziwy fd dla epoll).
+    """
+
+    def __init__(self, alive):
+        self.alive = set(alive)
+        self.inbox = []
+        self._r, self._w = socket.socketpair()
+        self._r.setblocking(False)
+
+    def setblocking(self, flag):
+        pass
+
+    def fileno(self):
+        return self._r.fileno()
+
+    def sendto(self, packet, addr):
+        if addr[0] in self.alive:
+            self.inbox.append((b"\x00\x00" + bytes(packet[2:]), addr))
+            self._w.send(b"x")
+        return len(packet)
+
+    def recvfrom_into(self, buf):
+        if not self.inbox:
+            raise BlockingIOError
+        self._r.recv(1)
+        data, addr = self.inbox.pop(0)
+        buf[:len(data)] = data
+        return len(data), addr
+
+    def close(self):
+        self._r.close()
+        self._w.close()
+
+
+class TestIcmpBatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.m = import_module_with_env()
+
+    def _batcher(self, alive):
+        sock = FakeIcmpSocket(alive)
+        self.addCleanup(sock.close)
+        with patch("socket.socket", return_value=sock):
+            return self.m.IcmpBatcher()
+
+    def test_checksum_known_vector(self):
+        # przykład z RFC 1071: 0001 f203 f4f5 f6f7 -> suma 0xddf2
+        data = bytes.fromhex("0001f203f4f5f6f7")
+        self.assertEqual(self.m.IcmpBatcher.checksum(data), ~0xDDF2 & 0xFFFF)
+
+    def test_checksum_odd_length_does_not_modify_input(self):
+        data = bytearray(b"\x08\x00\x00")
+        self.assertEqual(
+            self.m.IcmpBatcher.checksum(data),
+            self.m.IcmpBatcher.checksum(b"\x08\x00\x00\x00"),
+        )
+        self.assertEqual(data, bytearray(b"\x08\x00\x00"))
+
+    def test_packet_checksum_verifies(self):
+        b = self._batcher([])
+        pkt = b._packet(7)
+        self.assertEqual(pkt[0], 8)  # echo request
+        self.assertEqual(self.m.IcmpBatcher.checksum(pkt), 0)
+
+    def test_packet_template_matches_full_checksum(self):
+        b = self._batcher([])
+        for seq in (0, 1, 0x1234, 0xFFFE, 0xFFFF):
+            pkt = bytes(b._packet(seq))
+            expected = struct.pack("!BBHHH", 8, 0, 0, b._ident, seq) + b.PAYLOAD
+            csum = self.m.IcmpBatcher.checksum(expected)
+            self.assertEqual(pkt[6:8], struct.pack("!H", seq))
+            self.assertEqual(pkt[2:4], struct.pack("!H", csum))
+
+    def test_probe_marks_responding_hosts(self):
+        b = self._batcher(["1.1.1.1", "192.168.1.1"])
+        res = asyncio.run(b.probe(["192.168.1.1", "1.1.1.1", "8.8.8.8"], 0.05))
+        self.assertEqual(
+            res, {"192.168.1.1": True, "1.1.1.1": True, "8.8.8.8": False}
+        )
+
+    def test_returns_before_timeout_when_all_replied(self):
+        b = self._batcher(["1.1.1.1", "192.168.1.1"])
+        start = time.monotonic()
+        res = asyncio.run(b.probe(["192.168.1.1", "1.1.1.1"], 5))
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertTrue(all(res.values()))
+
+    def test_any_of_returns_after_first_reply(self):
+        b = self._batcher(["192.168.1.1", "1.1.1.1"])
+        start = time.monotonic()
+        res = asyncio.run(
+            b.probe(["192.168.1.1"], 5, any_of=["1.1.1.1", "8.8.8.8"])
+        )
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(
+            res, {"192.168.1.1": True, "1.1.1.1": True, "8.8.8.8": False}
+        )
+
+    def test_any_of_waits_for_required_hosts(self):
+        b = self._batcher(["1.1.1.1"])
+        start = time.monotonic()
+        res = asyncio.run(b.probe(["192.168.1.1"], 0.1, any_of=["1.1.1.1"]))
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertFalse(res["192.168.1.1"])
+        self.assertTrue(res["1.1.1.1"])
+
+    def test_raw_socket_reply_skips_ip_header(self):
+        b = self._batcher(["1.1.1.1"])
+        b._raw = True
+        orig_sendto = b._sock.sendto
+
+        def sendto_with_ip_header(packet, addr):
+            n = orig_sendto(packet, addr)
+            data, a = b._sock.inbox.pop()
+            ip_header = bytes([0x45]) + bytes(19)  # IPv4, IHL=5 (20 bajtów)
+            b._sock.inbox.append((ip_header + data, a))
+            return n
+
+        b._sock.sendto = sendto_with_ip_header
+        self.assertEqual(asyncio.run(b.probe(["1.1.1.1"], 0.5)), {"1.1.1.1": True})
+
+    def test_short_datagram_ignored(self):
+        b = self._batcher([])
+        b._sock.inbox.append((b"\x00\x00\x00", ("1.1.1.1", 0)))
+        b._sock._w.send(b"x")
+        self.assertEqual(asyncio.run(b.probe(["1.1.1.1"], 0.05)), {"1.1.1.1": False})
+
+    def test_stale_reply_from_previous_cycle_ignored(self):
+        b = self._batcher(["1.1.1.1"])
+
+        async def two_cycles():
+            await b.probe(["1.1.1.1"], 0.05)
+            # odpowiedź z poprzedniego cyklu (stary seq) dociera za późno
+            b._sock.sendto(b._packet(b._seq), ("1.1.1.1", 0))
+            b._sock.alive.clear()
+            return await b.probe(["1.1.1.1"], 0.05)
+
+        res = asyncio.run(two_cycles())
+        self.assertEqual(res, {"1.1.1.1": False})
+
+    def test_send_error_marks_host_down(self):
+        b = self._batcher(["1.1.1.1"])
+        b._sock.sendto = MagicMock(side_effect=OSError("Network unreachable"))
+        self.assertEqual(asyncio.run(b.probe(["1.1.1.1"], 0.05)), {"1.1.1.1": False})
+
+    def test_open_returns_none_without_permissions(self):
+        with patch("socket.socket", side_effect=PermissionError):
+            self.assertIsNone(self.m.open_icmp_batcher())
+
+    def test_classify_status_uses_batcher(self):
+        m = import_module_with_env({"ANPW_WAN_HOST": "5.6.7.8"})
+        batcher = MagicMock()
+        batcher.probe = AsyncMock()
+        batcher.probe.return_value = {
+            "192.168.1.1": True, "5.6.7.8": False, "1.1.1.1": False, "8.8.8.8": True,
+        }
+        with patch.object(m, "_BATCHER", batcher), \
+             patch.object(m, "ping_async") as mock_ping:
+            ok, label, diag = asyncio.run(
+                m.classify_status("192.168.1.1", force_full=True)
+            )
+
+        mock_ping.assert_not_called()
+        batcher.probe.assert_called_once()
+        self.assertEqual(batcher.probe.call_args.args[0], ["192.168.1.1", "5.6.7.8"])
+        self.assertEqual(batcher.probe.call_args.kwargs["any_of"], ["1.1.1.1", "8.8.8.8"])
+        self.assertTrue(ok)
+        self.assertEqual(diag, {"LAN": "UP", "WAN": "DOWN", "INTERNET": "UP"})
+
+
+# ══════════════════════════════════════════════
+# 11. main_async – przebieg przerwy w pętli głównej
+# ══════════════════════════════════════════════
+class StopLoop(Exception):
+    pass
+
+
+class TestMainLoop(unittest.TestCase):
+
+    UP = (True, "UP", {"LAN": "UP", "WAN": "N/A", "INTERNET": "UP"})
+    LAN_DOWN = (False, "LAN_DOWN", {"LAN": "DOWN", "WAN": "N/A", "INTERNET": "DOWN"})
+
+    def _run(self, m, statuses):
+        """Przepuść pętlę przez kolejne wyniki classify_status; zwraca mocki."""
+        classify = AsyncMock(side_effect=statuses)
+        sleep = AsyncMock(side_effect=[None] * (len(statuses) - 1) + [StopLoop])
+        notify = AsyncMock()
+        with patch.object(m, "classify_status", classify), \
+             patch.object(m, "notify", notify), \
+             patch.object(m, "open_icmp_batcher", return_value=None), \
+             patch.object(m, "discover_default_gateway", return_value="192.168.1.1"), \
+             patch.object(m.asyncio, "sleep", sleep):
+            with self.assertRaises(StopLoop):
+                asyncio.run(m.main_async())
+        return classify, notify
+
+    def test_outage_start_and_end_mails(self):
+        m = import_module_with_env()
+        _, notify = self._run(m, [self.LAN_DOWN] * 3 + [self.UP] * 2)
+
+        subjects = [c.args[0] for c in notify.call_args_list]
+        self.assertEqual(len(subjects), 2)
+        self.assertIn("Przerwa wykryta: LAN_DOWN", subjects[0])
+        self.assertIn("Koniec przerwy", subjects[1])
+        self.assertIn("Rodzaj przerwy: LAN_DOWN", notify.call_args_list[1].args[1])
+
+    def test_duration_uses_monotonic_clock(self):
+        m = import_module_with_env()
+        clock = [1000.0]
+        ticks = []
+
+        async def fake_sleep(sec):
+            ticks.append(sec)
+            if len(ticks) == 5:
+                raise StopLoop
+            clock[0] += 60  # każdy cykl "trwa" minutę zegara monotonicznego
+
+        with patch.object(m, "classify_status",
+                          AsyncMock(side_effect=[self.LAN_DOWN] * 3 + [self.UP] * 2)), \
+             patch.object(m, "notify", AsyncMock()) as notify, \
+             patch.object(m, "open_icmp_batcher", return_value=None), \
+             patch.object(m, "discover_default_gateway", return_value="192.168.1.1"), \
+             patch.object(m.asyncio, "sleep", side_effect=fake_sleep), \
+             patch("time.monotonic", side_effect=lambda: clock[0]):
+            with self.assertRaises(StopLoop):
+                asyncio.run(m.main_async())
+
+        # start przerwy w 3. cyklu, koniec w 5. -> 2 minuty
+        self.assertIn("Koniec przerwy (2m 0s)", notify.call_args_list[-1].args[0])
+
+    def test_mail_timestamps_from_single_wall_clock_read(self):
+        m = import_module_with_env()
+        # logging też czyta time.time(), więc na czas testu jest wyciszony
+        with patch("time.time", side_effect=[1_700_000_000.0, 1_700_000_600.0]), \
+             patch.object(m, "logging"):
+            _, notify = self._run(m, [self.LAN_DOWN] * 3 + [self.UP] * 2)
+
+        start_body = notify.call_args_list[0].args[1]
+        end_body = notify.call_args_list[1].args[1]
+        self.assertIn(f"Start przerwy: {m.fmt_ts(1_700_000_000.0)}", start_body)
+        self.assertIn(f"rozpoczęła się: {m.fmt_ts(1_700_000_000.0)}", end_body)
+        self.assertIn(f"zakończyła się: {m.fmt_ts(1_700_000_600.0)}", end_body)
+
+    def test_no_mail_below_fail_threshold(self):
+        m = import_module_with_env()
+        _, notify = self._run(m, [self.LAN_DOWN] * 2 + [self.UP])
+        notify.assert_not_called()
+
+    def test_full_probe_only_every_nth_tick_during_outage(self):
+        m = import_module_with_env({"ANPW_OUTAGE_FULL_PROBE_EVERY": "3"})
+        classify, _ = self._run(m, [self.LAN_DOWN] * 8)
+
+        flags = [c.args[1] for c in classify.call_args_list]
+        # 3 cykle do wykrycia przerwy (pełne), potem pełny co 3. cykl
+        self.assertEqual(flags, [True, True, True, True, False, False, True, False])
+
 
 # ══════════════════════════════════════════════
 # Uruchomienie bezpośrednie